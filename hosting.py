@@ -1,11 +1,17 @@
 import streamlit as st
-import pdfplumber
-import openpyxl
-import json
+import pymupdf
+import xlsxwriter
+import orjson
+import re
 import datetime
-from groq import Groq
+import asyncio
+import hashlib
+from groq import AsyncGroq
 import pandas as pd
 import os
+import tempfile
+import threading
+from collections import Counter, OrderedDict, defaultdict
 from io import BytesIO
 
 
@@ -15,139 +21,294 @@ st.set_page_config(
     layout="wide"
 )
 
-#Initializing Groq client
-@st.cache_resource
-def get_groq_client():
+#Reading Groq API key, async clients are created per run since they are bound to an event loop
+def get_groq_api_key():
     api_key = os.getenv('GROQ_API_KEY') or st.secrets.get("GROQ_API_KEY")
     if not api_key:
         st.error("GROQ_API_KEY not found. Please configure it in Streamlit secrets.")
         st.stop()
-    return Groq(api_key=api_key)
-
-client = get_groq_client()
-
-def extract_text(pdf_file):
-    full_text = ""
-    with pdfplumber.open(pdf_file) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
-            if page_text:
-                full_text += page_text + "\n"
-    return full_text.strip()
-
-def extract_structured_data(text):
-    prompt = """
-You are an expert data extraction AI specializing in converting unstructured biographical narratives into structured key-value pairs.
-
-Given the following text:
-
-{text}
-
-Your task:
-- Dynamically identify all factual elements and group them into logical key-value pairs. Keys should be concise and descriptive (e.g., "First Name", "Date of Birth", "Current Salary", "Certifications 1").
-- For values: Use exact original data where possible.
-  - Dates: Output in YYYY-MM-DD format if mentioned (or infer from context like "June 15, 2002" -> "15-Jun-02").
-  - Salaries: Numeric value without commas or currency (e.g., "350,000 INR" -> 350000 for salary, separate "INR" as "Salary Currency").
-  - Add Company/Organization name as value where there is salary mentioned, add previous, current prefix to the key value depending upon date of joining.
-  - If no company name is mentioned (or just terms like "first company","last company",etc. is used), then keep the value section blank
-  - Add date of joining and of leaving as and where is mentioned
-  - Percentages/Scores: Keep as it is (e.g., "92.5%" -> 92.5%, "8.7 on a n-point scale" -> 8.7 and then add the scale in comment section).
-  - Keep units in key or value if integral (e.g., "35 years" for age).
-  - For lists like certifications or skills, create sequential keys (e.g., "Certifications 1", "Certifications 2").
-  - For certifications or skills, add the certification exam/company in the value.
-  - For certifications or skills, add the year of certification and marks in the comment section.
-- For comments: Pull relevant contextual sentences or phrases from the original text using exact wording. Include all descriptive details, explanations, or additional info here. If a section is purely descriptive (e.g., technical skills paragraph), use an empty value and put the full description in comments.
-- Ensure 100% capture: No summarization, omission, or paraphrasing unless absolutely needed for a clean key-value (e.g., inferring "Birth City" from "born in Jaipur"). Preserve original sentence structure in comments.
-- Do not introduce new information.
-- Output ONLY a valid JSON array of objects in this exact format: [{{"key": "string", "value": "string or number as string", "comments": "string"}}]
-- Order logically: personal info, professional, education, certifications, skills.
-
-Make the JSON parsable and complete.
+    return api_key
+
+api_key = get_groq_api_key()
+
+MAX_TOKENS = 3000
+CHUNK_TOKENS = 1500
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+SEQUENTIAL_KEY = re.compile(r"^(.*\S)\s+(\d+)$")
+HEADER_FOOTER_LINES = 2
+PAGE_NUMBER = re.compile(r"^\s*(page\s*)?(\d{1,4})(\s*(of|/)\s*\d{1,4})?\s*$", re.IGNORECASE)
+RESPONSE_CACHE_ENTRIES = 32
+
+#Response cache shared across sessions, exact text hash only so a document never gets another one's data
+@st.cache_resource(ttl=86400)
+def get_response_cache():
+    #Every session thread shares this, entries are only touched while holding the lock
+    return {"entries": OrderedDict(), "lock": threading.Lock()}
+
+def save_upload(uploaded_file):
+    #Hashing while copying to disk in chunks, the parser then opens the file by path
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        for chunk in iter(lambda: uploaded_file.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            tmp.write(chunk)
+    return digest.hexdigest(), tmp.name
+
+def strip_page_artifacts(pages):
+    #Running headers/footers repeat among the first or last lines of most pages, page numbers match the page's own number
+    page_lines = [page.strip().splitlines() for page in pages]
+
+    def edges(lines):
+        content = [line.strip() for line in lines if line.strip()]
+        return set(content[:HEADER_FOOTER_LINES] + content[-HEADER_FOOTER_LINES:])
+
+    counts = Counter(line for lines in page_lines for line in edges(lines))
+    repeated = {line for line, count in counts.items() if count >= max(3, len(pages) / 2)} if len(pages) >= 3 else set()
+
+    def is_artifact(line, number):
+        match = PAGE_NUMBER.match(line)
+        return line.strip() in repeated or (bool(match) and int(match.group(2)) == number)
+
+    def drop_leading_artifacts(lines, number):
+        #Only the first few content lines are checked, the same text further down is real content
+        kept, checked = [], 0
+        for line in lines:
+            if line.strip() and checked < HEADER_FOOTER_LINES:
+                checked += 1
+                if is_artifact(line, number):
+                    continue
+            kept.append(line)
+        return kept
+
+    cleaned = []
+    for number, lines in enumerate(page_lines, start=1):
+        lines = drop_leading_artifacts(lines, number)
+        lines = drop_leading_artifacts(lines[::-1], number)[::-1]
+        cleaned.append("\n".join(lines).strip())
+    return cleaned
+
+#Streamlit reruns the script on every interaction, cache on the file hash to skip re-parsing
+@st.cache_data(show_spinner=False, max_entries=32)
+def extract_text(file_id, _pdf_path):
+    #Sequential on purpose: PyMuPDF is not thread-safe, and worker processes would re-run this script
+    with pymupdf.open(_pdf_path) as doc:
+        #Plain "text" mode skips layout analysis, the LLM only needs a string
+        parts = [page.get_text("text") for page in doc]
+
+    return "\n".join(strip_page_artifacts(parts)).strip()
+
+def normalize_text(text):
+    #Only used for cache lookups, the prompt still gets the original text
+    text = re.sub(r"\f|Page \d+ of \d+", "", text, flags=re.IGNORECASE)
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+async def extract_structured_data(text, on_progress=None):
+    cache = get_response_cache()
+    entries = cache["entries"]
+    cache_key = hashlib.sha256(normalize_text(text).encode()).hexdigest()
+    with cache["lock"]:
+        if cache_key in entries:
+            entries.move_to_end(cache_key)
+            return entries[cache_key]
+
+    #The lock is not held during the Groq requests
+    data = await request_chunks(chunk_text(text), on_progress)
+    with cache["lock"]:
+        entries[cache_key] = data
+        while len(entries) > RESPONSE_CACHE_ENTRIES:
+            entries.popitem(last=False)
+    return data
+
+#Kept byte-stable and sent ahead of the document so the provider can reuse the cached prefix
+SYSTEM_PROMPT = """
+Convert the user's unstructured biographical text into key-value records.
+Respond with JSON: {"items": [{"key": "string", "value": "string", "comments": "string"}]}
+Order items: personal info, professional, education, certifications, skills.
+
+key: concise and descriptive, e.g. "First Name", "Date of Birth", "Current Salary". Lists like certifications or skills get sequential keys ("Certifications 1", "Certifications 2").
+value: exact original data where possible.
+- Dates: YYYY-MM-DD if mentioned (or infer from context like "June 15, 2002" -> "15-Jun-02").
+- Salaries: number without commas or currency ("350,000 INR" -> 350000), currency as its own "Salary Currency" item.
+- Where a salary is mentioned, use the company/organization name as value and prefix the key with previous/current by date of joining. If no company is named (just "first company", "last company", etc.), leave the value blank.
+- Add date of joining and of leaving wherever mentioned.
+- Percentages/scores as written ("92.5%" -> 92.5%, "8.7 on a n-point scale" -> 8.7 with the scale in comments).
+- Keep units in key or value if integral ("35 years" for age).
+- Certifications or skills: exam/company as value, year and marks in comments.
+comments: relevant sentences or phrases from the original text, exact wording, with all descriptive details. A purely descriptive section (e.g. technical skills paragraph) gets an empty value and the full description in comments.
+
+Capture 100%: no summarization, omission or paraphrasing unless needed for a clean key-value (e.g. "Birth City" from "born in Jaipur"). Do not introduce new information.
 """
 
-    response = client.chat.completions.create(
+def chunk_text(text):
+    #Roughly 4 characters per Llama token, close enough to size chunks without a tokenizer
+    limit = CHUNK_TOKENS * 4
+    units = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        units.extend(paragraph.splitlines() if len(paragraph) > limit else [paragraph])
+
+    chunks, current = [], ""
+    for unit in units:
+        if current and len(current) + len(unit) + 2 > limit:
+            chunks.append(current)
+            current = unit
+        else:
+            current = f"{current}\n\n{unit}" if current else unit
+    if current:
+        chunks.append(current)
+    return chunks or [text]
+
+async def request_chunks(chunks, on_progress=None):
+    finished = [0]
+
+    #Reporting progress per finished chunk, JSON mode responses are not streamed
+    async def request_and_report(client, chunk):
+        data = await request_chunk(client, chunk)
+        finished[0] += 1
+        if on_progress:
+            on_progress(finished[0] / len(chunks))
+        return data
+
+    async with AsyncGroq(api_key=api_key) as client:
+        results = await asyncio.gather(*(request_and_report(client, chunk) for chunk in chunks))
+
+    return merge_chunk_results(results)
+
+def merge_chunk_results(results):
+    if len(results) == 1:
+        return results[0]
+
+    #Each chunk numbers its own "Certifications 1, 2..." keys from 1, continue that numbering across chunks
+    merged, seen, counters = [], set(), Counter()
+    for result in results:
+        numbers = defaultdict(set)
+        for item in result:
+            match = SEQUENTIAL_KEY.match(str(item.get("key", "")))
+            if match:
+                numbers[match.group(1)].add(int(match.group(2)))
+        sequential = {prefix for prefix, found in numbers.items() if found == set(range(1, len(found) + 1))}
+
+        for item in result:
+            #Only fully identical records are duplicates, blank-value sections differ by their comments
+            marker = (str(item.get("key")), str(item.get("value")), str(item.get("comments")))
+            if marker in seen:
+                continue
+            seen.add(marker)
+            match = SEQUENTIAL_KEY.match(str(item.get("key", "")))
+            if match and match.group(1) in sequential:
+                counters[match.group(1)] += 1
+                item = {**item, "key": f"{match.group(1)} {counters[match.group(1)]}"}
+            merged.append(item)
+    return merged
+
+async def request_chunk(client, text):
+    response = await client.chat.completions.create(
         model="llama-3.3-70b-versatile",
-        messages=[{"role": "user", "content": prompt.format(text=text)}],
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": text}
+        ],
         temperature=0.1,
-        max_tokens=3000
+        max_tokens=MAX_TOKENS,
+        response_format={"type": "json_object"}
     )
 
-    try:
-        json_str = response.choices[0].message.content.strip()
-        if json_str.startswith('```json'):
-            json_str = json_str[7:-3]
-        elif json_str.startswith('```'):
-            json_str = json_str[3:-3]
-        data = json.loads(json_str)
-        if not isinstance(data, list):
-            raise ValueError("Not a list")
-        return data
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Failed to parse JSON from Groq response: {e}")
+    #JSON mode only returns objects, so the records are wrapped in "items"
+    data = orjson.loads(response.choices[0].message.content).get("items")
+    if not isinstance(data, list):
+        raise ValueError("Groq response has no list of items")
+    return data
 
-def parse_date(value):
-    if not isinstance(value, str):
-        return value
-    value = value.strip()
+EXCEL_FIRST_DATE = datetime.date(1900, 1, 1)
+DATE_FORMATS = ["%d-%m-%Y", "%d/%m/%Y", "%Y-%m-%d", "%d-%b-%Y", "%d-%B-%Y"]
 
-    fmts = ["%d-%m-%Y", "%d/%m/%Y", "%Y-%m-%d", "%d-%b-%Y", "%d-%B-%Y"]
+def parse_dates(values):
+    #One vectorized pandas pass per format instead of a strptime loop per value
+    values = pd.Series(values, dtype=object)
+    is_text = values.map(lambda v: isinstance(v, str)).astype(bool)
+    text = values[is_text].str.strip()
 
-    for fmt in fmts:
-        try:
-            return datetime.datetime.strptime(value, fmt).date()
-        except ValueError:
-            pass
+    #Collecting plain dates in an object Series, a fixed datetime64 unit overflows on dates like 9999-12-31
+    parsed = pd.Series(None, index=text.index, dtype=object)
+    for fmt in DATE_FORMATS:
+        pending = parsed.isna()
+        if not pending.any():
+            break
+        dates = pd.to_datetime(text[pending], format=fmt, errors="coerce")
+        parsed = parsed.fillna(dates.dt.date[dates.notna()])
 
-    return value
+    values[is_text] = text.where(parsed.isna(), parsed)
+    return values.tolist()
 
-def create_excel_output(data):
-    #Creating Excel file in memory and returning as BytesIO
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Output"
+def prepare_workbook():
+    #Creating Excel file with the header row, independent of the extracted data
+    #constant_memory flushes each finished row to a temp file, rows must be written in order
+    output = BytesIO()
+    #default_date_format lets plain writes of parsed dates pick up DD-MMM-YY
+    wb = xlsxwriter.Workbook(output, {
+        "constant_memory": True,
+        "strings_to_urls": False,
+        "default_date_format": "DD-MMM-YY"
+    })
+    ws = wb.add_worksheet("Output")
 
-    ws.append(["Sr No.", "Key", "Value", "Comments"])
+    ws.write_row(0, 0, ["Sr No.", "Key", "Value", "Comments"])
+    return output, wb, ws
 
-    for row_idx, item in enumerate(data, start=2):
-        ws.cell(row=row_idx, column=1, value=row_idx - 1)
-        ws.cell(row=row_idx, column=2, value=item.get("key", ""))
+async def analyze_document(text, on_progress=None):
+    #Preparing the workbook in a worker thread while the Groq requests are in flight
+    data, workbook = await asyncio.gather(
+        extract_structured_data(text, on_progress),
+        asyncio.to_thread(prepare_workbook),
+        return_exceptions=True
+    )
+    #Closing the prepared workbook on failure, constant_memory keeps a temp file open until then
+    if isinstance(data, BaseException):
+        if not isinstance(workbook, BaseException):
+            workbook[1].close()
+        raise data
+    if isinstance(workbook, BaseException):
+        raise workbook
+    return data, workbook
 
-        raw_value = item.get("value", "")
-        excel_value = parse_date(raw_value)
-        cell = ws.cell(row=row_idx, column=3, value=excel_value)
-        if isinstance(excel_value, datetime.date):
-            cell.number_format = "DD-MMM-YY"
+def create_excel_output(df, workbook=None):
+    #Filling the workbook and returning it as BytesIO
+    output, wb, ws = workbook or prepare_workbook()
 
-        ws.cell(row=row_idx, column=4, value=item.get("comments", ""))
+    #Closing even when a row fails, constant_memory keeps a temp file open until then
+    try:
+        #Parsing every value first so the write loop is one write_row call per record
+        #Excel has no dates before 1900, those keep their original text
+        values = [
+            raw if isinstance(value, datetime.date) and value < EXCEL_FIRST_DATE else value
+            for raw, value in zip(df["value"].tolist(), parse_dates(df["value"]))
+        ]
+        rows = zip(df["key"].tolist(), values, df["comments"].tolist())
 
-    #Saving to BytesIO
-    output = BytesIO()
-    wb.save(output)
+        for row_idx, (key, value, comments) in enumerate(rows, start=1):
+            ws.write_row(row_idx, 0, (row_idx, key, value, comments))
+    finally:
+        wb.close()
     output.seek(0)
     return output
 
 def clean_comments(data):
-    df = pd.DataFrame(data)
+    #Object dtype keeps numbers the model returned as ints instead of upcasting to float
+    df = pd.DataFrame(data, columns=['key', 'value', 'comments'], dtype=object)
+    df[['key', 'value']] = df[['key', 'value']].fillna('')
     
-    if 'comments' not in df.columns:
-        return data
+    comments = df['comments'].fillna('').astype(str)
     
-    comments = df['comments'].fillna('').astype(str).str.strip()
+    df['comments'] = comments.where(~comments.duplicated(keep='last'), '')
     
-    df['comments'] = df['comments'].where(~df['comments'].duplicated(keep='last'), '')
+    #All comments in one NUL-separated buffer: a comment appears more than once only if another contains it
+    lowered = df['comments'].str.lower().str.replace('\0', '', regex=False).tolist()
+    haystack = '\0'.join(lowered)
+    drop = [bool(current) and haystack.count(current) > 1 for current in lowered]
     
-    comments = df['comments'].copy()
-    for i in range(len(df)):
-        if not comments[i]:
-            continue
-        current = comments[i].lower()
-        for j in range(len(df)):
-            if i != j and comments[j] and current in comments[j].lower():
-                if len(comments[i]) <= len(comments[j]):
-                    df.at[i, 'comments'] = ''
-                    break
+    df.loc[drop, 'comments'] = ''
     
-    return df.to_dict('records')
+    return df
 
 #Streamlit UI
 st.title("AI-Powered Document Structuring")
@@ -167,31 +328,38 @@ if uploaded_file:
     
     #Button for processing
     if st.button("Extract & Structure Data", type="primary", use_container_width=True):
+        workbook = None
         try:
             with st.spinner("Processing your document"):
                 progress = st.progress(0, "Extracting text from PDF")
-                text = extract_text(uploaded_file)
+                file_id, pdf_path = save_upload(uploaded_file)
+                try:
+                    text = extract_text(file_id, pdf_path)
+                finally:
+                    os.remove(pdf_path)
                 progress.progress(33, "Text extraction complete")
                 
                 progress.progress(33, "Analyzing document with AI")
-                structured_data = extract_structured_data(text)
+                structured_data, workbook = asyncio.run(analyze_document(
+                    text,
+                    on_progress=lambda done: progress.progress(33 + int(done * 33), "Analyzing document with AI")
+                ))
                 progress.progress(66, f"Extracted {len(structured_data)} key-value pairs!")
                 
                 # Step 3: Clean comments
                 progress.progress(66, "Cleaning and organizing data")
-                cleaned_data = clean_comments(structured_data)
+                cleaned_df = clean_comments(structured_data)
                 
                 # Step 4: Create Excel
                 progress.progress(90, "Generating Excel file")
-                excel_file = create_excel_output(cleaned_data)
+                excel_file = create_excel_output(cleaned_df, workbook)
                 progress.progress(100, "Processing complete")
                 
-                st.success(f"Successfully extracted {len(cleaned_data)} data points")
+                st.success(f"Successfully extracted {len(cleaned_df)} data points")
                 
                 #Preview of data
                 st.subheader("Data Preview")
-                preview_df = pd.DataFrame(cleaned_data)
-                st.dataframe(preview_df, use_container_width=True, height=400)
+                st.dataframe(cleaned_df, use_container_width=True, height=400)
                 
                 #Button for download
                 st.download_button(
@@ -203,6 +371,9 @@ if uploaded_file:
                 )
                 
         except Exception as e:
+            #Closing a workbook prepared for a run that failed before the export
+            if workbook and not workbook[1].fileclosed:
+                workbook[1].close()
             st.error(f"Error processing document: {str(e)}")
             st.exception(e)
 
@@ -224,8 +395,8 @@ with st.sidebar:
     
     st.header("Technical Stack")
     st.markdown("""
-    - **PDF Processing:** pdfplumber
+    - **PDF Processing:** PyMuPDF
     - **AI Model:** Groq (Llama 3.3 70B)
-    - **Excel Generation:** openpyxl
+    - **Excel Generation:** XlsxWriter
     - **Framework:** Streamlit
     """)